@@ -1,58 +1,86 @@
 """PicoW PowerMonitor"""
 
+import gc
 import sys
+import uos as os
 import rp2
+import micropython
+from micropython import const
 import network
-import ntptime
+import uarray as array
 import ubinascii
+import usocket as socket
+import ustruct as struct
 import utime as time
+import uasyncio as asyncio
 import st7789py as st7789
 from ina219 import INA219
 import ch_font_24 as ch_font
 import zh_font_24 as zh_font
-from umqttrobust import MQTTClient
-from machine import Pin, SPI, Timer, I2C, RTC
+from mqtt_as import MQTTClient, config
+from machine import Pin, SPI, I2C, RTC
 
 # ---------- INA219 register addresses ----------
-INA219_CONFIG_REG      = 0x00
-INA219_SHUNT_VOLTAGE   = 0x01
-INA219_BUS_VOLTAGE     = 0x02
-INA219_POWER           = 0x03
-INA219_CURRENT         = 0x04
-INA219_CALIBRATION     = 0x05
+_INA219_ADDR            = const(0x45)   # A0 = 1, A1 = 1
+_INA219_CONFIG_REG      = const(0x00)
+_INA219_SHUNT_VOLTAGE   = const(0x01)
+_INA219_BUS_VOLTAGE     = const(0x02)
+_INA219_POWER           = const(0x03)
+_INA219_CURRENT         = const(0x04)
+_INA219_CALIBRATION     = const(0x05)
 
 # ---------- LCD pinout ----------
-PIN_BL   = 13
-PIN_DC   = 8
-PIN_RST  = 12
-PIN_MOSI = 11
-PIN_SCK  = 10
-PIN_CS   = 9
+_PIN_BL   = const(13)
+_PIN_DC   = const(8)
+_PIN_RST  = const(12)
+_PIN_MOSI = const(11)
+_PIN_SCK  = const(10)
+_PIN_CS   = const(9)
 
 # ---------- INA219 I²C pins ----------
-SDA = 14
-SCL = 15
+_SDA = const(14)
+_SCL = const(15)
 
 # ---------- Global variables ----------
 cur_vol_v   = 0.000      # Real‑time voltage (V)
 cur_cur_mA  = 0.000      # Real‑time current (mA)
+cur_pwr_mW  = 0.000      # Real‑time power   (mW, V × mA)
 cur_pwr_W   = 0.000      # Real‑time power   (W)
 con_pwr_mWh = 0.000      # Accumulated energy (mWh)
+con_pwr_mWh_i = 0        # Accumulated energy, whole mWh (small int)
+con_pwr_uWs   = 0        # Accumulated energy remainder (µW·s, < 1 mWh)
+_UWS_PER_MWH  = const(3_600_000)
 cum_tim_s   = 0          # Accumulated time   (s)
 upt_tim_str = ""         # Timestamp string
 
 ntc_flag  = 0            # NTP sync flag
-mqtt_flag = 0            # MQTT connection flag
-loop_rtc  = 5
-loop_mqtt = 5
+ntp_busy  = 0            # NTP query in flight
+ntp_addr  = None         # Cached NTP server address (resolved once)
+loop_rtc  = 0            # Ticks until the next NTP attempt
 
 # ---------- String representations ----------
-str_vol_v    = "0.0"
-str_vol_ma   = "0"
-str_pwr_W    = "0.0"
-str_vol_mWh  = "0"
+FMT_V = "{:.3f}V   "   # Value + unit padding in one format call
+FMT_I = "{:.1f}mA  "
+FMT_P = "{:.3f}W   "
+FMT_E = "{:.0f}mWh "
+
+str_vol_v    = "0.000V   "
+str_vol_ma   = "0.0mA  "
+str_pwr_W    = "0.000W   "
+str_vol_mWh  = "0mWh "
 str_tim      = "00:00:00"
 
+# ---------- NTP ----------
+NTP_HOST  = 'ntp1.aliyun.com'
+NTP_DELTA = 2208988800                   # 1900‑01‑01 → 1970‑01‑01 (s)
+NTP_QUERY = b'\x1b' + b'\0' * 47         # SNTP v3 client request
+_NTP_RETRY     = const(3)                # Ticks between NTP attempts
+_NTP_DNS_RETRY = const(60)               # Back‑off after a failed (blocking) DNS lookup
+
+# ---------- MQTT telemetry payload ----------
+MQTT_TOPIC = 'pm/telemetry'
+MQTT_FMT   = '{{"t":"{}","v":{:.3f},"i":{:.1f},"p":{:.3f},"e":{:.0f},"u":"{}"}}'
+
 # ---------- Background colors ----------
 BG_LINE_1 = st7789.color565(106, 255,  42)
 BG_LINE_2 = st7789.color565( 80, 191,  32)
@@ -61,26 +89,31 @@ BG_LINE_4 = st7789.color565( 22,  95, 172)
 BG_LINE_5 = st7789.color565(235, 131, 107)
 BG_LINE_6 = st7789.color565(176,  98,  80)
 
-UPD_X = 104  # X‑coordinate for updated numerical values
+_UPD_X = const(104)  # X‑coordinate for updated numerical values
+
+# Pre‑rendered label screen: 240×240 RGB565 (big‑endian) raw image in flash,
+# generated from init_msg() by tools/make_labels.py
+LABEL_BG    = 'labels.raw'
+_LABEL_SIZE = const(240 * 240 * 2)
+_BAND_ROWS  = const(16)          # Rows streamed per SPI burst (16 × 480 B, 240 / 16 bands)
 
 # ---------- Hardware initialization ----------
 print("MicroPython version:")
 print(sys.implementation)
 
-tim = Timer(-1)
 led = Pin(25, Pin.OUT)
-i2c = I2C(1, scl=Pin(SCL), sda=Pin(SDA), freq=400_000)
+i2c = I2C(1, scl=Pin(_SCL), sda=Pin(_SDA), freq=400_000)
 
 key1 = Pin(2, Pin.IN, Pin.PULL_UP)
 key2 = Pin(1, Pin.IN, Pin.PULL_UP)
 
 tft = st7789.ST7789(
-    SPI(1, baudrate=60_000_000, sck=Pin(PIN_SCK), mosi=Pin(PIN_MOSI)),
+    SPI(1, baudrate=60_000_000, sck=Pin(_PIN_SCK), mosi=Pin(_PIN_MOSI)),
     240, 240,
-    reset=Pin(PIN_RST, Pin.OUT),
-    cs   =Pin(PIN_CS , Pin.OUT),
-    dc   =Pin(PIN_DC , Pin.OUT),
-    backlight=Pin(PIN_BL, Pin.OUT),
+    reset=Pin(_PIN_RST, Pin.OUT),
+    cs   =Pin(_PIN_CS , Pin.OUT),
+    dc   =Pin(_PIN_DC , Pin.OUT),
+    backlight=Pin(_PIN_BL, Pin.OUT),
     rotation=1
 )
 
@@ -100,246 +133,512 @@ rtc = RTC()
 rtc.datetime((2024, 1, 1, 0, 0, 0, 0, 0))  # (year, month, day, weekday, hour, minute, second, subseconds)
 
 # ---------- MQTT ----------
-mqtt_c = MQTTClient("picow9999", "broker.emqx.io", 1883, "admin", "admin", 60)
+def mqtt_sub_callback(topic, msg, retained):
+    print(topic, msg)
+
+
+config['server']    = 'broker.emqx.io'
+config['port']      = 1883
+config['client_id'] = 'picow9999'
+config['user']      = 'admin'
+config['password']  = 'admin'
+config['keepalive'] = 60
+config['ssid']      = ssid
+config['wifi_pw']   = pswd
+config['subs_cb']   = mqtt_sub_callback
+mqtt_c = MQTTClient(config)                  # mqtt_as: owns Wi‑Fi and the broker link
+mqtt_retry = asyncio.Event()                 # KEY2: retry the first connection now
+mqtt_ready = asyncio.Event()                 # Set once the first connect() has succeeded
 
 # ---------- INA219 ----------
 addr_list = i2c.scan()
 if len(addr_list) == 1:                      # exactly one I²C device found
-    ina = INA219(i2c, addr=0x45)             # A0 = 1, A1 = 1
+    ina = INA219(i2c, addr=_INA219_ADDR)
     ina.set_calibration_32V_1A()             # 32 V / 1 A range
 
 # -------------------------------------------------
 # Low‑level register read (for debugging)
 
+_reg_buf = bytearray(2)  # Reused I²C receive buffer (no per‑call allocation)
+
+
+@micropython.viper
+def _combine(buf: ptr8) -> int:
+    """Combine two big‑endian bytes into a 16‑bit value."""
+    return (int(buf[0]) << 8) | int(buf[1])
+
+
+@micropython.viper
+def _combine_s(buf: ptr8) -> int:
+    """Combine two big‑endian bytes into a signed (two's complement) 16‑bit value."""
+    v = (int(buf[0]) << 8) | int(buf[1])
+    if v & 0x8000:
+        v -= 0x10000
+    return v
+
+
 def read_ina219_register(register):
     """Read a raw 16‑bit value from a specific INA219 register."""
     try:
-        raw = i2c.readfrom_mem(0x45, register, 2)
-        return (raw[0] << 8) | raw[1]
+        i2c.readfrom_mem_into(_INA219_ADDR, register, _reg_buf)
+        return _combine(_reg_buf)
     except Exception as e:
         print("Register read error:", e)
         return None
 
+# UART debug ring buffer of 10‑byte records, all fields big‑endian ('>BBHhhH'):
+#   0xA5 0x5A | bus u16 | current i16 | shunt i16 | power u16
+# The sync header lets the host re‑align after text print() output on the same UART.
+_REC_SIZE = const(10)
+_TX_SIZE  = const(500)   # Multiple of _REC_SIZE, so a record never wraps
+_tx      = bytearray(_TX_SIZE)
+_tx_head = 0             # Write index (sampler)
+_tx_tail = 0             # Read index  (drainer)
 
+
+@micropython.native
 def real_time_register_read():
-    """Read INA219 registers in real time and print them over UART."""
+    """Read INA219 registers in real time and queue them for UART output."""
+    global _tx_head
     try:
-        data = {
-            "bus_voltage_raw":   read_ina219_register(INA219_BUS_VOLTAGE),
-            "current_raw":       read_ina219_register(INA219_CURRENT),
-            "shunt_voltage_raw": read_ina219_register(INA219_SHUNT_VOLTAGE),
-            "power_raw":         read_ina219_register(INA219_POWER),
-        }
-        print("{bus_voltage_raw},{current_raw},{shunt_voltage_raw},{power_raw}".format(**data))
-        return data
+        # One pointer write + 2‑byte read per register: the INA219 does not
+        # auto‑increment its register pointer, so a burst read is not possible.
+        rd = i2c.readfrom_mem_into
+        rd(_INA219_ADDR, _INA219_BUS_VOLTAGE, _reg_buf)
+        bus = _combine(_reg_buf)
+        rd(_INA219_ADDR, _INA219_CURRENT, _reg_buf)
+        current = _combine_s(_reg_buf)
+        rd(_INA219_ADDR, _INA219_SHUNT_VOLTAGE, _reg_buf)
+        shunt = _combine_s(_reg_buf)
+        rd(_INA219_ADDR, _INA219_POWER, _reg_buf)
+        power = _combine(_reg_buf)
+        nxt = (_tx_head + _REC_SIZE) % _TX_SIZE
+        if nxt != _tx_tail:                  # Drop the sample if the buffer is full
+            struct.pack_into('>BBHhhH', _tx, _tx_head, 0xA5, 0x5A, bus, current, shunt, power)
+            _tx_head = nxt
+        return bus, current, shunt, power
     except Exception as e:
         print("Register read error:", e)
         return None
 # -------------------------------------------------
 
-# Pad integer with leading zeroes
-
-def i2s_l(val, length=2):
-    s = str(val)
-    return '0' * (length - len(s)) + s
-
-
 def get_strftime():
     t_s = time.time() + 3600  # UTC+1 (example: adjust as needed)
     y, m, d, hh, mm, ss, *_ = time.localtime(t_s)
-    return f"{i2s_l(y,4)}-{i2s_l(m)}-{i2s_l(d)} {i2s_l(hh)}:{i2s_l(mm)}:{i2s_l(ss)}"
+    return "{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(y, m, d, hh, mm, ss)
 
 # -------- Obtain V, I, P --------
 
+@micropython.native
+def _clamp_pos(val):
+    """Clamp negative readings (reverse current / noise) to 0."""
+    return 0 if val < 0 else val
+
+
 def get_pwr_V_ma():
     """Fetch voltage and current from INA219 and compute real‑time power."""
-    global cur_vol_v, cur_cur_mA, cur_pwr_W
-    if len(addr_list) == 1:
-        cur_vol_v  = ina.bus_voltage               # V
-        cur_cur_mA = ina.current * 10              # mA (0.01 Ω shunt)
-    if cur_cur_mA < 0:
-        cur_cur_mA = 0
-    # P(W) = V * I(A)
-    cur_pwr_W = (cur_vol_v * cur_cur_mA) / 1000.0  # mA → A
+    global cur_vol_v, cur_cur_mA, cur_pwr_mW, cur_pwr_W
+    cur_vol_v  = ina.bus_voltage                   # V
+    cur_cur_mA = ina.current * 10                  # mA (0.01 Ω shunt)
+    cur_cur_mA = _clamp_pos(cur_cur_mA)
+    # P(mW) = V * I(mA), shared with the energy integration
+    cur_pwr_mW = cur_vol_v * cur_cur_mA
+    cur_pwr_W  = cur_pwr_mW / 1000.0               # mW → W
 
 
+@micropython.native
 def get_pwr_mWh():
-    """Integrate power over 1 s interval → energy (mWh)."""
-    global con_pwr_mWh
-    con_pwr_mWh += (cur_vol_v * cur_cur_mA) / 3600.0  # mW·s → mWh
+    """Integrate power over 1 s interval → energy (whole mWh + µW·s remainder)."""
+    global con_pwr_mWh_i, con_pwr_uWs
+    con_pwr_uWs += int(cur_pwr_mW * 1000)          # mW·s → µW·s
+    if con_pwr_uWs >= _UWS_PER_MWH:                # Carry whole mWh: both stay small ints
+        q = con_pwr_uWs // _UWS_PER_MWH
+        con_pwr_mWh_i += q
+        con_pwr_uWs   -= q * _UWS_PER_MWH
 
-# ------------ RTC & MQTT keep‑alive ------------
 
-def check_rtc():
-    global loop_rtc
-    loop_rtc = (loop_rtc + 1) % 40
-    if loop_rtc >= 3 and ntc_flag == 0 and sta_if.isconnected():
-        print("Attempting NTP sync…")
-        upd_rtc()
-        loop_rtc = 0
+# addr_list is fixed after boot: without a sensor, readings stay at 0
+if len(addr_list) != 1:
+    get_pwr_V_ma = get_pwr_mWh = lambda: None
 
+# ------------ RTC & MQTT keep‑alive ------------
 
-def check_mqtt_con():
-    global loop_mqtt
-    loop_mqtt = (loop_mqtt + 1) % 40
-    if loop_mqtt >= 3 and mqtt_flag == 0 and sta_if.isconnected():
-        print("Attempting MQTT connection…")
-        con_mqtt_server()
-        loop_mqtt = 0
+def check_rtc(connected):
+    global loop_rtc, ntp_busy
+    if loop_rtc > 0:
+        loop_rtc -= 1
+    elif ntc_flag == 0 and not ntp_busy and connected:
+        print("Attempting NTP sync…")
+        ntp_busy = 1
+        loop_rtc = _NTP_RETRY
+        asyncio.create_task(ntp_sync())
 
 
-def mqtt_check_msg():
-    if sta_if.isconnected():
+async def mqtt_check_msg():
+    # isconnected() is True while connect() is still running, so wait for a
+    # completed first connection before publishing.
+    await mqtt_ready.wait()
+    if mqtt_c.isconnected():
         try:
-            mqtt_c.publish('str_tim',     str_tim)
-            mqtt_c.publish('str_vol_v',   str_vol_v)
-            mqtt_c.publish('str_vol_ma',  str_vol_ma)
-            mqtt_c.publish('str_pwr_W',   str_pwr_W)
-            mqtt_c.publish('str_vol_mWh', str_vol_mWh)
-            mqtt_c.publish('upt_tim_str', upt_tim_str)
+            # The payload is formatted here, after the wait, so it is never older
+            # than this tick. Not wrapped in wait_for: cancelling mid‑write would
+            # leave a truncated PUBLISH on the socket. If the link drops during
+            # publish(), mqtt_as retries until it reconnects; only this task waits.
+            await mqtt_c.publish(MQTT_TOPIC, MQTT_FMT.format(
+                str_tim, cur_vol_v, cur_cur_mA, cur_pwr_W, con_pwr_mWh, upt_tim_str))
         except Exception as e:
             print("MQTT publish error:", e)
 
 # ------------ String conversion ------------
 
 def tran_to_str():
-    global str_vol_v, str_vol_ma, str_pwr_W, str_vol_mWh, str_tim
-    str_vol_v   = "{:.3f}".format(cur_vol_v)
-    str_vol_ma  = "{:.1f}".format(cur_cur_mA)
-    str_pwr_W   = "{:.3f}".format(cur_pwr_W)
-    str_vol_mWh = "{:.0f}".format(con_pwr_mWh)
+    global str_vol_v, str_vol_ma, str_pwr_W, str_vol_mWh, str_tim, con_pwr_mWh
+    con_pwr_mWh = con_pwr_mWh_i + con_pwr_uWs / _UWS_PER_MWH
+    str_vol_v   = FMT_V.format(cur_vol_v)
+    str_vol_ma  = FMT_I.format(cur_cur_mA)
+    str_pwr_W   = FMT_P.format(cur_pwr_W)
+    str_vol_mWh = FMT_E.format(con_pwr_mWh)
     str_tim     = sec_to_str(cum_tim_s)
 
 
 # Seconds → hh:mm:ss
 
+@micropython.native
 def sec_to_str(sec):
     h = sec // 3600
     m = (sec % 3600) // 60
     s = sec % 60
-    return f"{i2s_l(h)}:{i2s_l(m)}:{i2s_l(s)}"
+    return "{:02d}:{:02d}:{:02d}".format(h, m, s)
 
 # ------------------- LCD -------------------
 
+# Text row raster for write_fast: widest row is the full screen width
+_glyph_buf = bytearray(240 * 2 * zh_font.HEIGHT)
+_glyph_mv  = memoryview(_glyph_buf)
+_glyph_arg = array.array('i', [0] * 8)   # stride, bit, x0, w, cw, h, fg, bg
+
+
+@micropython.viper
+def _raster(dst: ptr16, src: ptr8, arg: ptr32):
+    """Expand one 1‑bpp glyph into the RGB565 row buffer at column x0."""
+    stride = arg[0]
+    bit    = arg[1]
+    x0     = arg[2]
+    w      = arg[3]
+    cw     = arg[4]
+    h      = arg[5]
+    fg     = arg[6]
+    bg     = arg[7]
+    for row in range(h):
+        p = row * stride + x0
+        for col in range(w):
+            if col < cw:
+                if src[bit >> 3] & (0x80 >> (bit & 7)):
+                    dst[p + col] = fg
+                else:
+                    dst[p + col] = bg
+            bit += 1
+
+
+def write_fast(font, text, x, y, fg, bg):
+    """tft.write() that rasterises the whole string and sends one SPI burst."""
+    fmap   = font.MAP
+    widths = font.WIDTHS
+    total  = 0
+    for ch in text:
+        i = fmap.find(ch)
+        if i >= 0:
+            total += widths[i]
+    total = min(total, 240 - x)              # Clip at the right screen edge
+    if total <= 0:
+        return
+    h    = font.HEIGHT
+    ow   = font.OFFSET_WIDTH
+    offs = font.OFFSETS
+    arg  = _glyph_arg
+    arg[0] = total
+    arg[5] = h
+    arg[6] = ((fg & 0xff) << 8) | (fg >> 8)  # Byte‑swap: RGB565 is big‑endian on the wire
+    arg[7] = ((bg & 0xff) << 8) | (bg >> 8)
+    col = 0
+    for ch in text:
+        i = fmap.find(ch)
+        if i < 0:
+            continue
+        bit = 0
+        for k in range(i * ow, i * ow + ow):
+            bit = (bit << 8) | offs[k]
+        w = widths[i]
+        arg[1] = bit
+        arg[2] = col
+        arg[3] = w
+        arg[4] = min(w, total - col)
+        _raster(_glyph_buf, font.BITMAPS, arg)
+        col += w
+        if col >= total:
+            break
+    tft.blit_buffer(_glyph_mv[:total * h * 2], x, y, total, h)
+
+
+def blit_labels():
+    """Stream LABEL_BG from flash to the LCD; False if missing or wrong size."""
+    try:
+        if os.stat(LABEL_BG)[6] != _LABEL_SIZE:
+            print("Ignoring", LABEL_BG, "(wrong size)")
+            return False
+        f = open(LABEL_BG, 'rb')
+    except OSError:
+        return False
+    buf = bytearray(240 * 2 * _BAND_ROWS)
+    mv = memoryview(buf)
+    with f:
+        for y in range(0, 240, _BAND_ROWS):
+            n = f.readinto(buf)
+            if not n:
+                break
+            tft.blit_buffer(mv[:n], 0, y, 240, n // 480)
+    return True
+
+
 def init_msg():
+    if blit_labels():
+        return
+
     # 1. Voltage label
     tft.fill_rect(0, 4, 240, 36, BG_LINE_1)
-    tft.write(zh_font, "Voltage", 0, 8, st7789.BLACK, BG_LINE_1)
+    write_fast(zh_font, "Voltage", 0, 8, st7789.BLACK, BG_LINE_1)
 
     # 2. Current label
     tft.fill_rect(0, 44, 240, 36, BG_LINE_2)
-    tft.write(zh_font, "Current", 0, 48, st7789.BLACK, BG_LINE_2)
+    write_fast(zh_font, "Current", 0, 48, st7789.BLACK, BG_LINE_2)
 
     # 3. Accumulated energy label (mWh)
     tft.fill_rect(0, 84, 240, 36, BG_LINE_3)
-    tft.write(zh_font, "Energy", 0, 88, st7789.BLACK, BG_LINE_3)
+    write_fast(zh_font, "Energy", 0, 88, st7789.BLACK, BG_LINE_3)
 
     # 4. Real‑time power label (W)
     tft.fill_rect(0, 124, 240, 36, BG_LINE_4)
-    tft.write(zh_font, "P(W)", 0, 128, st7789.BLACK, BG_LINE_4)
+    write_fast(zh_font, "P(W)", 0, 128, st7789.BLACK, BG_LINE_4)
 
     # 5. Wi‑Fi label
     tft.fill_rect(0, 164, 240, 36, BG_LINE_5)
-    tft.write(zh_font, "WiFi", 0, 168, st7789.BLACK, BG_LINE_5)
+    write_fast(zh_font, "WiFi", 0, 168, st7789.BLACK, BG_LINE_5)
 
     # 6. Timestamp label (background only)
     tft.fill_rect(0, 204, 240, 36, BG_LINE_6)
 
 
-def show_msg():
+_last = {'v': None, 'i': None, 'e': None, 'p': None, 'w': None, 't': None}  # Last drawn text
+
+
+def show_msg(connected):
     # 1. Voltage value
-    tft.write(zh_font, str_vol_v + "V   ", UPD_X, 8,  st7789.BLACK, BG_LINE_1)
+    if str_vol_v != _last['v']:
+        write_fast(zh_font, str_vol_v, _UPD_X, 8,  st7789.BLACK, BG_LINE_1)
+        _last['v'] = str_vol_v
     # 2. Current value
-    tft.write(zh_font, str_vol_ma + "mA  ", UPD_X, 48, st7789.BLACK, BG_LINE_2)
+    if str_vol_ma != _last['i']:
+        write_fast(zh_font, str_vol_ma, _UPD_X, 48, st7789.BLACK, BG_LINE_2)
+        _last['i'] = str_vol_ma
     # 3. Energy value
-    tft.write(zh_font, str_vol_mWh + "mWh ", UPD_X, 88, st7789.BLACK, BG_LINE_3)
+    if str_vol_mWh != _last['e']:
+        write_fast(zh_font, str_vol_mWh, _UPD_X, 88, st7789.BLACK, BG_LINE_3)
+        _last['e'] = str_vol_mWh
     # 4. Real‑time power value
-    tft.write(zh_font, str_pwr_W + "W   ",  UPD_X, 128, st7789.BLACK, BG_LINE_4)
+    if str_pwr_W != _last['p']:
+        write_fast(zh_font, str_pwr_W,  _UPD_X, 128, st7789.BLACK, BG_LINE_4)
+        _last['p'] = str_pwr_W
     # 5. Wi‑Fi state
-    wifi_txt = "Connected" if sta_if.isconnected() else "Disconnected"
-    tft.write(zh_font, wifi_txt, UPD_X, 168, st7789.BLACK, BG_LINE_5)
-    # 6. Timestamp
-    tft.write(zh_font, upt_tim_str, 12, 208, st7789.BLACK, BG_LINE_6)
+    wifi_txt = "Connected" if connected else "Disconnected"
+    if wifi_txt != _last['w']:
+        write_fast(zh_font, wifi_txt, _UPD_X, 168, st7789.BLACK, BG_LINE_5)
+        _last['w'] = wifi_txt
+    # 6. Timestamp (redraw from the first changed character only)
+    old = _last['t']
+    if upt_tim_str != old:
+        i = 0
+        if old is not None and len(old) == len(upt_tim_str):
+            while upt_tim_str[i] == old[i]:
+                i += 1
+        x = 12 + tft.write_width(zh_font, upt_tim_str[:i]) if i else 12
+        write_fast(zh_font, upt_tim_str[i:], x, 208, st7789.BLACK, BG_LINE_6)
+        _last['t'] = upt_tim_str
 
 # ------------------- Keys -------------------
 
-def key_scan():
-    """KEY1 resets counters; KEY2 tries to reconnect Wi‑Fi."""
-    global cum_tim_s, con_pwr_mWh
-    if key1.value() == 0:
-        cum_tim_s   = 0
-        con_pwr_mWh = 0
-    if key2.value() == 0:
-        con_wifi()
+_kflag = bytearray(2)              # Sticky press flags, set from the Pin IRQs
+_kdeb  = bytearray(2)              # Debounce shift registers (bit = pressed sample)
+_karm  = bytearray(b'\x01\x01')    # Re‑armed once the key is steadily released
 
-# ------------------- Network -------------------
 
-def con_wifi():
-    timeout = 10
-    sta_if.connect(ssid, pswd)
-    while timeout > 0:
-        if sta_if.status() < 0 or sta_if.status() >= 3:
-            break
-        timeout -= 1
-        print('Waiting for Wi‑Fi connection…')
-        time.sleep(1)
-    print('Wi‑Fi config:', sta_if.ifconfig())
+@micropython.viper
+def _deb(s: int, lvl: int) -> int:
+    """Shift one level sample into an 8‑sample history (0xFF / 0x00 = steady)."""
+    return ((s << 1) | lvl) & 0xff
+
 
+def _key1_irq(pin):
+    _kflag[0] = 1
 
-def upd_rtc():
-    global ntc_flag
+
+def _key2_irq(pin):
+    _kflag[1] = 1
+
+
+key1.irq(trigger=Pin.IRQ_FALLING, handler=_key1_irq)
+key2.irq(trigger=Pin.IRQ_FALLING, handler=_key2_irq)
+
+
+def key_pressed(i, pin):
+    """True once per press: an IRQ edge while armed; bounce edges are dropped."""
+    s = _deb(_kdeb[i], pin.value() ^ 1)
+    _kdeb[i] = s
+    if s == 0:
+        _karm[i] = 1
+    if _kflag[i]:
+        _kflag[i] = 0
+        if _karm[i]:
+            _karm[i] = 0
+            return True
+    return False
+
+
+def key_scan():
+    """KEY1 resets counters; KEY2 retries the Wi‑Fi/MQTT connection now."""
+    global cum_tim_s, con_pwr_mWh_i, con_pwr_uWs
+    if key_pressed(0, key1):
+        cum_tim_s     = 0
+        con_pwr_mWh_i = 0
+        con_pwr_uWs   = 0
+    if key_pressed(1, key2):
+        mqtt_retry.set()           # No‑op once mqtt_as has connected (it reconnects itself)
+
+# ------------------- Network -------------------
+
+async def ntp_sync():
+    """SNTP query on a non‑blocking UDP socket; sets the RTC to UTC."""
+    global ntc_flag, ntp_busy, ntp_addr, loop_rtc
+    s = None
     try:
-        ntptime.host = 'ntp1.aliyun.com'
-        ntptime.settime()
+        if ntp_addr is None:
+            # getaddrinfo blocks the event loop: resolve once, back off on failure
+            try:
+                ntp_addr = socket.getaddrinfo(NTP_HOST, 123)[0][-1]
+            except OSError:
+                loop_rtc = _NTP_DNS_RETRY
+                raise
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setblocking(False)
+        s.sendto(NTP_QUERY, ntp_addr)
+        for _ in range(60):                  # 60 × 50 ms = 3 s timeout
+            await asyncio.sleep_ms(50)
+            try:
+                data = s.recv(48)
+                break
+            except OSError:
+                pass
+        else:
+            raise OSError("timeout")
+        ts = struct.unpack('!I', data[40:44])[0] - NTP_DELTA
+        y, m, d, hh, mm, ss, wd, _ = time.gmtime(ts)
+        rtc.datetime((y, m, d, wd, hh, mm, ss, 0))
         ntc_flag = 1
         print("NTP sync succeeded")
     except Exception as e:
         ntc_flag = 0
+        ntp_addr = None                      # Re‑resolve on the next attempt
         print("NTP sync failed:", e)
+    finally:
+        ntp_busy = 0
+        if s:
+            s.close()
 
 
-def con_mqtt_server():
-    global mqtt_flag
-    try:
-        mqtt_c.connect(False)
-        mqtt_flag = 1
-        print("MQTT connected")
-    except Exception as e:
-        mqtt_flag = 0
-        print("MQTT connection failed:", e)
-
-
-def mqtt_sub_callback(topic, msg):
-    print(topic, msg)
+async def con_mqtt_server():
+    """Bring up Wi‑Fi and the broker; mqtt_as keeps both connected afterwards."""
+    while True:
+        print("Attempting MQTT connection…")
+        try:
+            await mqtt_c.connect()
+            mqtt_ready.set()
+            print("MQTT connected")
+            print('Wi‑Fi config:', sta_if.ifconfig())
+            return
+        except OSError as e:
+            print("MQTT connection failed:", e)
+        mqtt_retry.clear()
+        try:
+            await asyncio.wait_for(mqtt_retry.wait(), 40)
+        except asyncio.TimeoutError:
+            pass
 
-# ------------------- Timer callback -------------------
+# ------------------- Tasks -------------------
 
-def timer_fun(tim):
+# Helpers are bound as default arguments (fast locals instead of global lookups)
+def tick(_strftime=get_strftime, _pv=get_pwr_V_ma, _pw=get_pwr_mWh,
+         _toggle=led.toggle, _isconn=sta_if.isconnected, _rtc=check_rtc,
+         _tran=tran_to_str, _show=show_msg, _collect=gc.collect):
+    """One 1 s step: sample INA219, refresh strings and the LCD."""
     global cum_tim_s, upt_tim_str
-    upt_tim_str = get_strftime()
-    get_pwr_V_ma()
-    get_pwr_mWh()
-    led.toggle()
-    check_rtc()
-    tran_to_str()
-    show_msg()
-    check_mqtt_con()
-    mqtt_check_msg()
+    upt_tim_str = _strftime()
+    _pv()
+    _pw()
+    _toggle()
+    connected = _isconn()  # Queried once per tick
+    _rtc(connected)
+    _tran()
+    _show(connected)
     cum_tim_s += 1
+    _collect()  # Collect once per tick so GC pauses stay predictable
+
+
+async def sampler():
+    ticks_ms, ticks_add, ticks_diff = time.ticks_ms, time.ticks_add, time.ticks_diff
+    sleep_ms = asyncio.sleep_ms
+    t = ticks_ms()
+    while True:
+        tick()
+        t = ticks_add(t, 1000)  # Fixed 1 s period (energy integration relies on it)
+        await sleep_ms(max(0, ticks_diff(t, ticks_ms())))
+
+
+async def publisher():
+    while True:
+        await mqtt_check_msg()
+        await asyncio.sleep_ms(1000)
+
+
+async def keys():
+    while True:
+        key_scan()
+        await asyncio.sleep_ms(20)
+
+
+async def drainer():
+    """Flush queued register records to UART in contiguous chunks."""
+    global _tx_tail
+    mv = memoryview(_tx)
+    while True:
+        head = _tx_head
+        if head != _tx_tail:
+            end = head if head > _tx_tail else _TX_SIZE
+            sys.stdout.buffer.write(mv[_tx_tail:end])
+            _tx_tail = end % _TX_SIZE
+        await asyncio.sleep_ms(100)
 
 # ------------------- Main -------------------
 
-def main():
-    tim.init(period=1000, mode=Timer.PERIODIC, callback=timer_fun)
-    mqtt_c.set_callback(mqtt_sub_callback)
+async def main():
     init_msg()
-    show_msg()
-    con_wifi()
+    show_msg(sta_if.isconnected())
+    asyncio.create_task(sampler())
+    asyncio.create_task(publisher())
+    asyncio.create_task(keys())
+    asyncio.create_task(drainer())
+    asyncio.create_task(con_mqtt_server())
 
     while True:
-        key_scan()
         real_time_register_read()  # Debug read
-        time.sleep(1)         # 1 sampling
-
-main()
+        await asyncio.sleep(1)     # 1 sampling
 
+asyncio.run(main())
@@ -0,0 +1,114 @@
+"""Render labels.raw for main.py on the host (CPython).
+
+The image is produced by running init_msg() from main.py against an
+in‑memory 240×240 RGB565 framebuffer, so label text, positions and
+BG_LINE_* colours always match the fallback drawing on the device.
+
+Usage:
+    python tools/make_labels.py --font-dir <dir with zh_font_24.py> [-o labels.raw]
+
+Copy the result to the Pico W filesystem next to main.py.
+"""
+
+import ast
+import argparse
+import importlib
+import os
+import sys
+
+WIDTH  = 240
+HEIGHT = 240
+HERE   = os.path.dirname(os.path.abspath(__file__))
+MAIN   = os.path.join(HERE, '..', 'main.py')
+
+
+def color565(red, green, blue):
+    """Same packing as st7789py.color565."""
+    return (red & 0xF8) << 8 | (green & 0xFC) << 3 | blue >> 3
+
+
+class Frame:
+    """Minimal stand‑in for the ST7789 driver used by init_msg()."""
+
+    def __init__(self):
+        self.px = [0] * (WIDTH * HEIGHT)
+
+    def fill_rect(self, x, y, w, h, color):
+        for row in range(max(y, 0), min(y + h, HEIGHT)):
+            base = row * WIDTH
+            for col in range(max(x, 0), min(x + w, WIDTH)):
+                self.px[base + col] = color
+
+    def write(self, font, text, x, y, fg, bg):
+        """Host version of main.write_fast (proportional 1‑bpp font)."""
+        ow = font.OFFSET_WIDTH
+        for ch in text:
+            i = font.MAP.find(ch)
+            if i < 0:
+                continue
+            bit = 0
+            for k in range(i * ow, i * ow + ow):
+                bit = (bit << 8) | font.OFFSETS[k]
+            w = font.WIDTHS[i]
+            for row in range(font.HEIGHT):
+                for col in range(w):
+                    on = font.BITMAPS[bit >> 3] & (0x80 >> (bit & 7))
+                    if 0 <= x + col < WIDTH and 0 <= y + row < HEIGHT:
+                        self.px[(y + row) * WIDTH + x + col] = fg if on else bg
+                    bit += 1
+            x += w
+
+    def to_bytes(self):
+        return b''.join(p.to_bytes(2, 'big') for p in self.px)
+
+
+def load_init_msg(path):
+    """Return init_msg() from main.py plus the BG_LINE_* assignments it uses."""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    colors, func = [], None
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id.startswith('BG_LINE_')):
+            colors.append(node)
+        elif isinstance(node, ast.FunctionDef) and node.name == 'init_msg':
+            func = node
+    if func is None:
+        sys.exit("init_msg() not found in " + path)
+    # Drop the `if blit_labels(): return` shortcut: always draw
+    func.body = [n for n in func.body if not (
+        isinstance(n, ast.If) and isinstance(n.test, ast.Call)
+        and getattr(n.test.func, 'id', None) == 'blit_labels')]
+    return ast.Module(body=colors + [func], type_ignores=[])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--font-dir', required=True, help="directory containing zh_font_24.py")
+    ap.add_argument('-o', '--output', default='labels.raw')
+    args = ap.parse_args()
+
+    sys.path.insert(0, args.font_dir)
+    font = importlib.import_module('zh_font_24')
+
+    frame = Frame()
+    st7789 = type('st7789', (), {'color565': staticmethod(color565), 'BLACK': 0})
+    ns = {
+        'st7789': st7789,
+        'tft': frame,
+        'zh_font': font,
+        'write_fast': frame.write,
+    }
+    exec(compile(ast.fix_missing_locations(load_init_msg(MAIN)), MAIN, 'exec'), ns)
+    ns['init_msg']()
+
+    data = frame.to_bytes()
+    assert len(data) == WIDTH * HEIGHT * 2
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    print("Wrote", args.output, len(data), "bytes")
+
+
+if __name__ == '__main__':
+    main()